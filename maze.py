@@ -1,4 +1,3 @@
-from collections import deque
 from vexcode_vr import *
 
 # ================================================================================
@@ -20,7 +19,15 @@ location = Location("location", 9)
 # ============================== Constant setup ==================================
 # ================================================================================
 # Heading offsets: 0 = North, 1 = East, 2 = South, 3 = West.
-OFFSETS = {0: (0, 1), 1: (1, 0), 2: (0, -1), 3: (-1, 0)}
+OFFSETS = ((0, 1), (1, 0), (0, -1), (-1, 0))
+# Reverse lookup from a cell offset to its heading.
+DIRECTION_MAP = {offset: heading for heading, offset in enumerate(OFFSETS)}
+# Turn command (direction, degrees) indexed by (current heading, target heading), None when no turn is needed.
+TURN_TABLE = {
+    (current, target): (None, (RIGHT, 90), (RIGHT, 180), (LEFT, 90))[(target - current) % 4]
+    for current in range(4)
+    for target in range(4)
+}
 CELL_SIZE = 250  # Distance (mm) between cells.
 WALL_THRESHOLD = 260  # Minimum sensor reading (mm) to consider a corridor open.
 
@@ -30,60 +37,95 @@ OPEN = "🟩"  # Open cell/passage
 ROUTE = "🟦"  # Fastest route
 START_EXIT = "⬛"  # Start and exit marker
 
-
-def get_neighbour_cell(position, direction):
-    """
-    Given a maze cell position and a heading (0=N, 1=E, 2=S, 3=W),
-    return the coordinate of the neighbouring cell.
-    """
-    dx, dy = OFFSETS[direction]
-    return position[0] + dx, position[1] + dy
+# Symbol codes stored in the visualisation grid, each one indexes SYMBOLS.
+WALL_ID, OPEN_ID, ROUTE_ID, START_EXIT_ID = range(4)
+SYMBOLS = (WALL, OPEN, ROUTE, START_EXIT)
 
 
 # ================================================================================
 # =========================== Maze Navigator Class ===============================
 # ================================================================================
 class MazeNavigator:
+    __slots__ = (
+        "position",
+        "heading",
+        "graph",
+        "visited",
+        "exit_cell",
+        "_clear_cache",
+        "_top_row",
+        "_adjacency",
+    )
+
     def __init__(self):
         self.position = (0, 0)
         self.heading = 0
         self.graph = {}
         self.visited = set()
         self.exit_cell = None
+        # Front sensor readings keyed by (cell, heading); walls never move so entries are never invalidated.
+        self._clear_cache = {}
+        # Highest row reached so far; the exit is on the top row of the maze so lower cells are not checked.
+        self._top_row = None
+        # Compressed sparse row copy of the graph used by the path search, rebuilt whenever the graph changes.
+        self._adjacency = None
 
     def add_connection(self, cell_a, cell_b):
         """
         Add a connection between two maze cells in the graph.
+        Neighbours are kept in plain lists, as a cell has at most four the duplicate check is cheap.
+        """
+        neighbours = self.graph.setdefault(cell_a, [])
+        if cell_b not in neighbours:
+            neighbours.append(cell_b)
+            self.graph.setdefault(cell_b, []).append(cell_a)
+            self._adjacency = None
+
+    def build_adjacency(self):
         """
-        self.graph.setdefault(cell_a, set()).add(cell_b)
-        self.graph.setdefault(cell_b, set()).add(cell_a)
+        Pack the maze graph into compressed sparse row (CSR) form for the path search.
+
+        Every cell in the bounding box of the graph is numbered (x - min_x) + (y - min_y) * width,
+        and the neighbours of cell number i are neighbours[offsets[i]:offsets[i + 1]].
+        """
+        if not self.graph:
+            self._adjacency = (0, 0, 0, 0, [0], [])
+            return self._adjacency
+
+        xs, ys = zip(*self.graph)
+        min_x, max_x = min(xs), max(xs)
+        min_y, max_y = min(ys), max(ys)
+        width = max_x - min_x + 1
+        height = max_y - min_y + 1
+
+        offsets = [0]
+        neighbours = []
+        for y in range(min_y, max_y + 1):
+            for x in range(min_x, max_x + 1):
+                for nx, ny in self.graph.get((x, y), ()):
+                    neighbours.append((nx - min_x) + (ny - min_y) * width)
+                offsets.append(len(neighbours))
+
+        self._adjacency = (min_x, min_y, width, height, offsets, neighbours)
+        return self._adjacency
 
     # ------------------ Movement functions ------------------
     def set_heading(self, target_heading):
         """
         Turn the robot to face the given heading (0=N, 1=E, 2=S, 3=W).
         """
-        try:
-            turn_amount = (target_heading - self.heading) % 4
-            if turn_amount == 1:
-                drivetrain.turn_for(RIGHT, 90, DEGREES)
-            elif turn_amount == 2:
-                drivetrain.turn_for(RIGHT, 180, DEGREES)
-            elif turn_amount == 3:
-                drivetrain.turn_for(LEFT, 90, DEGREES)
-            self.heading = target_heading
-        except Exception as e:
-            print("An error occurred during heading adjustment:", e)
+        turn = TURN_TABLE[self.heading, target_heading]
+        if turn:
+            drivetrain.turn_for(*turn, DEGREES)
+        self.heading = target_heading
 
-    def move_forward(self):
+    def move_forward(self, cells=1):
         """
-        Move the robot forward by one cell and update its position.
+        Move the robot forward by the given number of cells (one by default) and update its position.
         """
-        try:
-            drivetrain.drive_for(FORWARD, CELL_SIZE, MM)
-            self.position = get_neighbour_cell(self.position, self.heading)
-        except Exception as e:
-            print("An error occurred during forward movement:", e)
+        drivetrain.drive_for(FORWARD, CELL_SIZE * cells, MM)
+        dx, dy = OFFSETS[self.heading]
+        self.position = (self.position[0] + dx * cells, self.position[1] + dy * cells)
 
     # ------------------ Detection Functions ------------------
     def is_path_clear(self):
@@ -93,34 +135,75 @@ class MazeNavigator:
         There is a special case for the start and ending cells as these have an open wall below and above respectively.
         The special case ensures that the robot does not leave the map.
         """
-        try:
-            if self.position == (0, 0) and self.heading == 2:
-                return False
-            if (
-                self.exit_cell is not None
-                and self.position == self.exit_cell
-                and self.heading == 0
-            ):
-                return False
-            return front_distance.get_distance(MM) >= WALL_THRESHOLD
-        except Exception as e:
-            print("An error occurred during path detection:", e)
+        if self.position == (0, 0) and self.heading == 2:
             return False
+        if (
+            self.exit_cell is not None
+            and self.position == self.exit_cell
+            and self.heading == 0
+        ):
+            return False
+
+        # Record every reading. The DFS only senses each cell and heading once, so the stored readings are
+        # mainly reused when a neighbour is checked from the other side of the same wall (see _try_direction).
+        key = (self.position, self.heading)
+        if key in self._clear_cache:
+            return self._clear_cache[key]
+        clear = front_distance.get_distance(MM) >= WALL_THRESHOLD
+        self._clear_cache[key] = clear
+        return clear
 
     def is_at_exit(self):
         """
         Uses the eye sensor to detect the red exit marker.
         """
-        try:
-            return down_eye.detect(RED)
-        except Exception as e:
-            print("An error occurred during exit detection:", e)
-            return False
+        return down_eye.detect(RED)
 
     # ------------------ Depth First Search ------------------
+    def visit_cell(self, cell):
+        """
+        Mark a cell as visited and check whether it is the exit, recording the exit cell if found.
+        """
+        self.visited.add(cell)
+
+        # The exit is on the top row of the maze (opposite the start), so a cell below a row that has
+        # already been reached cannot be the exit.
+        if self._top_row is not None and cell[1] < self._top_row:
+            return
+        self._top_row = cell[1]
+
+        # Each cell is only entered once, and the sensor is not read at all once the exit is known.
+        if self.exit_cell is None and self.is_at_exit():
+            self.exit_cell = cell
+            print(f"Exit detected at {cell}")
+
+    def _try_direction(self, cell, heading):
+        """
+        Check whether the path out of a cell in the given heading is clear.
+        Return a tuple of whether it is clear and the neighbouring cell in that heading.
+
+        If the neighbour has already been visited and sensed facing back into this cell that reading is
+        reused, so the robot does not need to drive back, turn or take another reading. The shortcut is only
+        taken for visited neighbours, as the robot is not moved to the cell and must never drive into the
+        neighbour from here.
+        """
+        dx, dy = OFFSETS[heading]
+        neighbour = (cell[0] + dx, cell[1] + dy)
+        if neighbour in self.visited:
+            known = self._clear_cache.get((neighbour, (heading + 2) % 4))
+            if known is not None:
+                return known, neighbour
+
+        # Finished cells are popped without moving, so drive to this cell over the known map first.
+        self.drive_to(cell)
+        self.set_heading(heading)
+        return self.is_path_clear(), neighbour
+
     def explore_maze(self, current_cell, current_heading):
         """
-        Recursively explore the maze using depth-first search (DFS), trying to minimize the number of turns.
+        Explore the maze using depth-first search (DFS), trying to minimize the number of turns.
+        The search uses an explicit stack of (cell, heading, remaining offsets) frames rather than
+        recursion, so larger mazes cannot hit the recursion limit.
 
         For each cell:
             1. Mark the cell as visited.
@@ -131,90 +214,109 @@ class MazeNavigator:
                 - Right (offset 1)
                 - Back (offset 2)
             4. If the path is clear, add the neighbour to the graph.
-            5. If the neighbour is unvisited, move into it and recursively explore.
-            6. After exploring, backtrack to the current cell.
+            5. If the neighbour is unvisited, move into it and push it onto the stack.
+            6. Once every direction has been tried, pop the cell without moving.
+
+        The robot only drives back when the next cell on the stack still has directions to try, taking the
+        shortest known route (BFS) rather than retracing every dead end step by step.
         """
-        try:
-            # Mark the current cell as visited.
-            self.visited.add(current_cell)
-
-            # Check if the current cell is the exit, record the exit cell if found.
-            if self.is_at_exit() and self.exit_cell is None:
-                self.exit_cell = current_cell
-                print(f"Exit detected at {current_cell}")
-
-            # Try directions in order: forward, left, right, back.
-            for offset in [0, -1, 1, 2]:
-                new_heading = (current_heading + offset) % 4
-                self.set_heading(new_heading)
-
-                # If the path in the new heading is clear, process the neighbour.
-                if self.is_path_clear():
-                    neighbour = get_neighbour_cell(current_cell, new_heading)
-                    self.add_connection(current_cell, neighbour)
-
-                    # Only explore if the neighbour has not been visited.
-                    if neighbour not in self.visited:
-                        self.move_forward()
-                        self.explore_maze(neighbour, new_heading)
-                        # Backtrack turn around, move back, turn back to original heading.
-                        self.set_heading((new_heading + 2) % 4)
-                        self.move_forward()
-                        self.set_heading(current_heading)
-        except Exception as e:
-            print("An error occurred during maze exploration:", e)
+        self.visit_cell(current_cell)
+        stack = [(current_cell, current_heading, iter([0, -1, 1, 2]))]
+        while stack:
+            cell, heading, offsets = stack[-1]
+
+            # Try the remaining directions in order: forward, left, right, back.
+            offset = next(offsets, None)
+            if offset is None:
+                # Every direction has been tried, so this cell is fully explored.
+                stack.pop()
+                continue
+
+            # If the path in the new heading is clear, process the neighbour.
+            new_heading = (heading + offset) % 4
+            clear, neighbour = self._try_direction(cell, new_heading)
+            if clear:
+                self.add_connection(cell, neighbour)
+
+                # Only explore if the neighbour has not been visited.
+                if neighbour not in self.visited:
+                    self.move_forward()
+                    self.visit_cell(neighbour)
+                    stack.append((neighbour, new_heading, iter([0, -1, 1, 2])))
+
+        # Return to the starting cell once the whole maze has been mapped.
+        self.drive_to(current_cell)
 
     # ------------------ Breadth First Search ------------------
     def find_shortest_path(self, start, goal):
         """
-        Find the shortest path from the start to the goal using breadth-first search (BFS).
+        Find the shortest path from the start to the goal using bidirectional breadth-first search (BFS).
         Return the path as a list of cell coordinates.
         """
         try:
-            # Use a dictionary to store the predecessors of each cell in the path.
-            predecessors = {start: None}
-            # Initialise the BFS queue with the start cell.
-            queue = deque([start])
-            while queue:
-                current = queue.popleft()
-                if current == goal:
-                    break
-
-                # Add unvisited neighbours to the queue to explore.
-                for neighbour in self.graph.get(current, set()):
-                    if neighbour not in predecessors:
-                        predecessors[neighbour] = current
-                        queue.append(neighbour)
-
-            # Reconstruct the path from the goal to the start using the predecessors.
-            path = []
-            node = goal
-            while node is not None:
-                path.append(node)
-                node = predecessors.get(node)
-            return list(reversed(path))
+            # Search the CSR copy of the graph, rebuilding it if cells were connected since it was made.
+            adjacency = self._adjacency
+            if adjacency is None:
+                adjacency = self.build_adjacency()
+            min_x, min_y, width, height, offsets, neighbours = adjacency
+
+            # Cells outside the mapped area cannot be reached.
+            if start == goal or not (
+                0 <= start[0] - min_x < width
+                and 0 <= start[1] - min_y < height
+                and 0 <= goal[0] - min_x < width
+                and 0 <= goal[1] - min_y < height
+            ):
+                return [goal]
+
+            # Search between the cell numbers and convert the result back to cell coordinates.
+            start_index = (start[0] - min_x) + (start[1] - min_y) * width
+            goal_index = (goal[0] - min_x) + (goal[1] - min_y) * width
+            path = _bfs_csr(offsets, neighbours, start_index, goal_index, width * height)
+            if not path:
+                return [goal]
+            return [(min_x + node % width, min_y + node // width) for node in path]
         except Exception as e:
             print("An error occurred during pathfinding:", e)
             return []
 
     # ------------------ Path Traversal ------------------
-    def traverse_path(self, path):
+    def traverse_path(self, path, reverse=False):
         """
-        Traverse the given path by following the sequence of cell coordinates.
-        For each pair of adjacent cells, turn towards the next cell and move forward.
+        Traverse the given path by following the sequence of cell coordinates, from the last cell
+        back to the first when reverse is set.
+        The heading of every step is worked out up front, then each run of steps in the same
+        heading is driven as a single forward movement after one turn.
         """
-        direction_map = {(0, 1): 0, (1, 0): 1, (0, -1): 2, (-1, 0): 3}
-        for i in range(1, len(path)):
-            try:
-                current, next_cell = path[i - 1], path[i]
-                delta = (next_cell[0] - current[0], next_cell[1] - current[1])
-                target_heading = direction_map.get(delta)
-                if target_heading is None:
-                    continue
-                self.set_heading(target_heading)
-                self.move_forward()
-            except Exception as e:
-                print(f"Error traversing from {current} to {next_cell}: {e}")
+        step = -1 if reverse else 1
+        steps = range(len(path) - 2, -1, -1) if reverse else range(1, len(path))
+        headings = []
+        for i in steps:
+            current, next_cell = path[i - step], path[i]
+            target_heading = DIRECTION_MAP.get((next_cell[0] - current[0], next_cell[1] - current[1]))
+            if target_heading is not None:
+                headings.append(target_heading)
+
+        run_start = 0
+        while run_start < len(headings):
+            target_heading = headings[run_start]
+            run_end = run_start + 1
+            while run_end < len(headings) and headings[run_end] == target_heading:
+                run_end += 1
+            self.set_heading(target_heading)
+            self.move_forward(run_end - run_start)
+            run_start = run_end
+
+    def drive_to(self, cell):
+        """
+        Drive to the given cell along the shortest known path, if the robot is not already there.
+        Raise an error if the robot does not end up in the cell, rather than carrying on from the wrong place.
+        """
+        if self.position == cell:
+            return
+        self.traverse_path(self.find_shortest_path(self.position, cell))
+        if self.position != cell:
+            raise RuntimeError(f"Could not drive to {cell}, the robot stopped at {self.position}")
 
     def solve_maze(self):
         """
@@ -253,11 +355,76 @@ class MazeNavigator:
             print("Following route to exit...")
             self.traverse_path(route)
             print("At exit. Returning to base...")
-            self.traverse_path(list(reversed(route)))
+            self.traverse_path(route, reverse=True)
             print("Mission complete!")
         except Exception as e:
             print("An error occurred during maze solving:", e)
 
+# -------------------- Breadth First Search --------------------
+def _bfs_csr(offsets, neighbours, start, goal, size):
+    """
+    Find the shortest path between two cell numbers of a CSR graph using bidirectional breadth-first search.
+    Return the path as a list of cell numbers, or an empty list if the goal cannot be reached.
+
+    This only works on plain integer lists so it is kept separate from the cell coordinates.
+    """
+    # Track which cells each search has reached and the predecessor of each cell (-1 for none).
+    seen_fwd = bytearray(size)
+    seen_bwd = bytearray(size)
+    predecessors_fwd = [-1] * size
+    predecessors_bwd = [-1] * size
+    seen_fwd[start] = 1
+    seen_bwd[goal] = 1
+
+    # Search from the start and the goal at the same time, each step expanding a whole level of
+    # the smaller frontier. The first edge found between the two searches lies on a shortest path,
+    # as both searches have covered every cell up to their current depth.
+    frontier_fwd = [start]
+    frontier_bwd = [goal]
+    meeting = None
+    while frontier_fwd and frontier_bwd and meeting is None:
+        forward = len(frontier_fwd) <= len(frontier_bwd)
+        if forward:
+            frontier, seen, predecessors, other_seen = frontier_fwd, seen_fwd, predecessors_fwd, seen_bwd
+        else:
+            frontier, seen, predecessors, other_seen = frontier_bwd, seen_bwd, predecessors_bwd, seen_fwd
+
+        # Add unvisited neighbours to the next level, stopping as soon as the searches meet.
+        next_frontier = []
+        for current in frontier:
+            for index in neighbours[offsets[current]:offsets[current + 1]]:
+                if other_seen[index]:
+                    meeting = (current, index) if forward else (index, current)
+                    break
+                if not seen[index]:
+                    seen[index] = 1
+                    predecessors[index] = current
+                    next_frontier.append(index)
+            if meeting is not None:
+                break
+
+        if forward:
+            frontier_fwd = next_frontier
+        else:
+            frontier_bwd = next_frontier
+
+    if meeting is None:
+        return []
+
+    # Reconstruct the path by walking back from the meeting point to the start, then on to the goal.
+    path = []
+    node = meeting[0]
+    while node != -1:
+        path.append(node)
+        node = predecessors_fwd[node]
+    path.reverse()
+    node = meeting[1]
+    while node != -1:
+        path.append(node)
+        node = predecessors_bwd[node]
+    return path
+
+
 # -------------------- Unicode Maze Generation --------------------
 def generate_unicode_maze_text(graph, visited, start, exit_cell, route=None):
     """
@@ -279,10 +446,9 @@ def generate_unicode_maze_text(graph, visited, start, exit_cell, route=None):
         # Find the minimum and maximum coordinates of the visited cells.
         # These will be used to determine the grid dimensions. (Allows for potentially future expansion and handling
         # of larger mazes)
-        min_x = min(x for (x, _) in visited)
-        max_x = max(x for (x, _) in visited)
-        min_y = min(y for (_, y) in visited)
-        max_y = max(y for (_, y) in visited)
+        xs, ys = zip(*visited)
+        min_x, max_x = min(xs), max(xs)
+        min_y, max_y = min(ys), max(ys)
 
         # Calculate the grid dimensions based on the range of visited cells.
         num_cols = max_x - min_x + 1
@@ -290,58 +456,52 @@ def generate_unicode_maze_text(graph, visited, start, exit_cell, route=None):
         grid_width = num_cols * 2 + 1
         grid_height = num_rows * 2 + 1
 
-        # Initialize the grid with walls.
-        grid = [[WALL for _ in range(grid_width)] for _ in range(grid_height)]
+        # Initialize the grid with walls. The grid is a flat bytearray of symbol codes, stored row by row,
+        # which are only swapped for the Unicode symbols once, when the final string is built.
+        grid = bytearray([WALL_ID]) * (grid_width * grid_height)
 
         # ------------------ Maze to Grid Conversion ------------------
         def maze_to_grid(maze_cell):
             """
-            Convert a maze cell coordinate to the corresponding grid cell coordinate.
+            Convert a maze cell coordinate to the index of the corresponding grid cell.
             The grid cell is the center of the corresponding maze cell.
             """
             x, y = maze_cell
-            return (max_y - y) * 2 + 1, (x - min_x) * 2 + 1
+            return ((max_y - y) * 2 + 1) * grid_width + (x - min_x) * 2 + 1
 
-        # Mark the open cells that have been visited.
-        for cell in visited:
-            r, c = maze_to_grid(cell)
-            grid[r][c] = OPEN
+        # Mark the open cells that have been visited, converting each cell to a grid index only once.
+        grid_cells = {cell: maze_to_grid(cell) for cell in visited}
+        for index in grid_cells.values():
+            grid[index] = OPEN_ID
 
         # ------------------ Add Passages ------------------
         # Add passages between visited cells that are connected in the graph.
+        # Each passage is only drawn from the lower of its two cells, as both cells list it.
         for cell in visited:
             if cell in graph:
                 for neighbour in graph[cell]:
-                    if neighbour in visited:
-                        # Convert the maze cell coordinates to grid coordinates.
-                        r1, c1 = maze_to_grid(cell)
-                        r2, c2 = maze_to_grid(neighbour)
-
-                        # Calculate the passage cell between the two cells.
-                        passage_r = (r1 + r2) // 2
-                        passage_c = (c1 + c2) // 2
-                        grid[passage_r][passage_c] = OPEN
+                    if neighbour > cell and neighbour in visited:
+                        # The passage cell sits halfway between the two cells, in the grid row or column.
+                        grid[(grid_cells[cell] + grid_cells[neighbour]) // 2] = OPEN_ID
 
         # ------------------ Add Route and Start/Exit ------------------
         # Mark the fastest route cells with the distinct symbol.
         if route:
             for i in range(len(route)):
-                r, c = maze_to_grid(route[i])
-                grid[r][c] = ROUTE
+                index = maze_to_grid(route[i])
+                grid[index] = ROUTE_ID
                 if i < len(route) - 1:
-                    r_next, c_next = maze_to_grid(route[i + 1])
-                    mid_r = (r + r_next) // 2
-                    mid_c = (c + c_next) // 2
-                    grid[mid_r][mid_c] = ROUTE
+                    grid[(index + maze_to_grid(route[i + 1])) // 2] = ROUTE_ID
 
         # Mark the start and exit cells.
-        sr, sc = maze_to_grid(start)
-        er, ec = maze_to_grid(exit_cell)
-        grid[sr][sc] = START_EXIT
-        grid[er][ec] = START_EXIT
-
-        # Convert the grid to a string representation.
-        return "\n".join("".join(row) for row in grid)
+        grid[maze_to_grid(start)] = START_EXIT_ID
+        grid[maze_to_grid(exit_cell)] = START_EXIT_ID
+
+        # Convert the grid to a string representation, one row at a time.
+        return "\n".join(
+            "".join([SYMBOLS[code] for code in grid[row : row + grid_width]])
+            for row in range(0, len(grid), grid_width)
+        )
     except Exception as e:
         print("An error occurred during maze generation:", e)
         return ""